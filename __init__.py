@@ -1,9 +1,17 @@
+import logging
 from typing import TYPE_CHECKING
 
+import discord.utils
+
 from .cog import TournamentCog
 
 if TYPE_CHECKING:                          
     from ballsdex.core.bot import BallsDexBot
+
+log = logging.getLogger("ballsdex.packages.tournament")
     
 async def setup(bot: "BallsDexBot"):
+    # discord.py picks orjson up on its own when installed, it cannot be enabled from here
+    if not discord.utils.HAS_ORJSON:
+        log.info("orjson is not installed, discord.py will serialize payloads with the slower json module")
     await bot.add_cog(TournamentCog(bot))
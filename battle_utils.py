@@ -1,8 +1,18 @@
 from dataclasses import dataclass, field
+import io
 import random
+import struct
+from typing import Optional
 
+MISS_CHANCE = 0.30
 
-@dataclass
+# Packed ball layout for sending teams to worker processes:
+# country name (UTF-8, NUL padded), health, attack. Country names are up to
+# 48 characters, the name field fits them at 4 bytes per character
+BALL_STRUCT = struct.Struct("<192sii")
+
+
+@dataclass(slots=True)
 class BattleBall:
     name: str
     owner: str
@@ -12,97 +22,185 @@ class BattleBall:
     dead: bool = False
 
 
-@dataclass
+@dataclass(slots=True)
 class BattleInstance:
     p1_balls: list = field(default_factory=list)
     p2_balls: list = field(default_factory=list)
     winner: str = ""
     turns: int = 0
+    p1_alive: int = 0
+    p2_alive: int = 0
 
 
-def get_damage(ball):
-    return int(ball.attack * random.uniform(0.8, 1.2))
+def get_damage(ball, roll):
+    return int(ball.attack * (0.8 + 0.4 * roll))
 
 
-def attack(current_ball, enemy_balls):
-    alive_balls = [ball for ball in enemy_balls if not ball.dead]
-    enemy = random.choice(alive_balls)
+def attack(current_ball, alive_enemies, roll, rng: random.Random):
+    """Apply one attack and return the targeted ball and the damage dealt
 
-    attack_dealt = get_damage(current_ball)
+    ``alive_enemies`` is kept up to date: a killed ball is removed from it.
+    """
+    enemy = rng.choice(alive_enemies)
+
+    attack_dealt = get_damage(current_ball, roll)
     enemy.health -= attack_dealt
 
     if enemy.health <= 0:
         enemy.health = 0
         enemy.dead = True
-    
-    if enemy.dead:
-        gen_text = f"{current_ball.owner}'s {current_ball.name} has killed {enemy.owner}'s {enemy.name}"
+        alive_enemies.remove(enemy)
+
+    return enemy, attack_dealt
+
+
+def format_event(event):
+    """Render a battle event yielded by gen_battle as a log line"""
+    turn, kind, attacker, target, attack_dealt = event
+    if kind == "stare":
+        return "Everyone stared at each other, resulting in nobody winning."
+    if kind == "miss":
+        text = f"{attacker.owner}'s {attacker.name} missed {target.owner}'s {target.name}"
+    elif kind == "kill":
+        text = f"{attacker.owner}'s {attacker.name} has killed {target.owner}'s {target.name}"
     else:
-        gen_text = f"{current_ball.owner}'s {current_ball.name} has dealt {attack_dealt} damage to {enemy.owner}'s {enemy.name}"
-    return gen_text
+        text = f"{attacker.owner}'s {attacker.name} has dealt {attack_dealt} damage to {target.owner}'s {target.name}"
+    return f"Turn {turn}: {text}"
 
 
-def random_events():
-    if random.randint(0, 100) <= 30:  # 30% miss chance
+def random_events(roll):
+    if roll < MISS_CHANCE:
         return 1
     else:
         return 0
 
 
-def gen_battle(battle: BattleInstance):
-    """Generate battle between two players"""
+def gen_battle(battle: BattleInstance, emit_log: bool = True, rng: Optional[random.Random] = None):
+    """Generate battle between two players
+
+    Yields ``(turn, kind, attacker, target, damage)`` events, where ``kind`` is
+    one of ``"stare"``, ``"miss"``, ``"hit"`` or ``"kill"``; use format_event to
+    turn them into text. When ``emit_log`` is False the battle is still fully
+    resolved but nothing is yielded. All randomness comes from ``rng``, a
+    fresh ``random.Random`` when not given.
+    """
     turn = 0
 
     # Check if all balls do no damage
     if all(ball.attack <= 0 for ball in battle.p1_balls + battle.p2_balls):
-        yield "Everyone stared at each other, resulting in nobody winning."
+        if emit_log:
+            yield (turn, "stare", None, None, 0)
         return
 
-    while any(ball for ball in battle.p1_balls if not ball.dead) and any(
-        ball for ball in battle.p2_balls if not ball.dead
-    ):
-        alive_p1_balls = [ball for ball in battle.p1_balls if not ball.dead]
-        alive_p2_balls = [ball for ball in battle.p2_balls if not ball.dead]
+    if rng is None:
+        rng = random.Random()
+    next_roll = rng.random
+
+    p1_targets = [ball for ball in battle.p1_balls if not ball.dead]
+    p2_targets = [ball for ball in battle.p2_balls if not ball.dead]
+    battle.p1_alive = len(p1_targets)
+    battle.p2_alive = len(p2_targets)
+
+    # With equal team sizes, balls are paired by team position for the whole
+    # battle and dead balls skip their turn; otherwise living balls are paired
+    # again at the start of every round
+    equal_teams = len(battle.p1_balls) == len(battle.p2_balls)
 
-        for p1_ball, p2_ball in zip(alive_p1_balls, alive_p2_balls):
+    while battle.p1_alive and battle.p2_alive:
+        if equal_teams:
+            pairs = zip(battle.p1_balls, battle.p2_balls)
+        else:
+            pairs = zip(list(p1_targets), list(p2_targets))
+
+        for p1_ball, p2_ball in pairs:
             # Player 1 attacks first
             if not p1_ball.dead:
                 turn += 1
 
-                event = random_events()
+                event = random_events(next_roll())
                 if event == 1:
-                    yield f"Turn {turn}: {p1_ball.owner}'s {p1_ball.name} missed {p2_ball.owner}'s {p2_ball.name}"
+                    if emit_log:
+                        yield (turn, "miss", p1_ball, p2_targets[0] if p2_ball.dead else p2_ball, 0)
                     continue
-                yield f"Turn {turn}: {attack(p1_ball, battle.p2_balls)}"
+                enemy, attack_dealt = attack(p1_ball, p2_targets, next_roll(), rng)
+                if emit_log:
+                    yield (turn, "kill" if enemy.dead else "hit", p1_ball, enemy, attack_dealt)
 
-                if all(ball.dead for ball in battle.p2_balls):
-                    break
+                if enemy.dead:
+                    battle.p2_alive -= 1
+                    if battle.p2_alive == 0:
+                        break
 
             # Player 2 attacks
             if not p2_ball.dead:
                 turn += 1
 
-                event = random_events()
+                event = random_events(next_roll())
                 if event == 1:
-                    yield f"Turn {turn}: {p2_ball.owner}'s {p2_ball.name} missed {p1_ball.owner}'s {p1_ball.name}"
+                    if emit_log:
+                        yield (turn, "miss", p2_ball, p1_targets[0] if p1_ball.dead else p1_ball, 0)
                     continue
-                yield f"Turn {turn}: {attack(p2_ball, battle.p1_balls)}"
+                enemy, attack_dealt = attack(p2_ball, p1_targets, next_roll(), rng)
+                if emit_log:
+                    yield (turn, "kill" if enemy.dead else "hit", p2_ball, enemy, attack_dealt)
 
-                if all(ball.dead for ball in battle.p1_balls):
-                    break
+                if enemy.dead:
+                    battle.p1_alive -= 1
+                    if battle.p1_alive == 0:
+                        break
 
     # Determine the winner
-    if all(ball.dead for ball in battle.p1_balls):
+    if battle.p1_alive == 0:
         battle.winner = battle.p2_balls[0].owner
-    elif all(ball.dead for ball in battle.p2_balls):
+    elif battle.p2_alive == 0:
         battle.winner = battle.p1_balls[0].owner
 
     # Set turns
     battle.turns = turn
 
 
-def simulate_tournament_battle(player1_balls, player2_balls, player1_name, player2_name):
-    """Simulate a battle between two tournament players"""
+def pack_team(balls) -> bytes:
+    """Pack tournament balls into a single bytes object using BALL_STRUCT"""
+    return b"".join(
+        BALL_STRUCT.pack(ball.country.encode(), ball.health, ball.attack)
+        for ball in balls
+    )
+
+
+def unpack_team(data: bytes, owner: str) -> list:
+    """Rebuild battle balls from a team packed with pack_team"""
+    return [
+        BattleBall(
+            name=name.rstrip(b"\0").decode(errors="ignore"),
+            owner=owner,
+            health=health,
+            attack=attack
+        )
+        for name, health, attack in BALL_STRUCT.iter_unpack(data)
+    ]
+
+
+def simulate_packed_battle(player1_team, player2_team, player1_name, player2_name, with_log=True, seed=None):
+    """Simulate a battle between two teams packed with pack_team
+
+    Same result as simulate_tournament_battle, meant to be submitted to a
+    process pool so each side crosses the process boundary as one bytes object.
+    """
+    battle = BattleInstance(
+        p1_balls=unpack_team(player1_team, player1_name),
+        p2_balls=unpack_team(player2_team, player2_name)
+    )
+    return run_battle(battle, with_log, seed)
+
+
+def simulate_tournament_battle(player1_balls, player2_balls, player1_name, player2_name, with_log=True, seed=None):
+    """Simulate a battle between two tournament players
+
+    The battle log is written line by line into ``battle_log_buf``, an
+    ``io.StringIO`` left positioned at its end. Pass ``with_log=False`` when
+    only the winner and turn count are needed; ``battle_log_buf`` is then None.
+    Pass ``seed`` to replay a battle exactly.
+    """
     # Convert tournament balls to battle balls
     p1_battle_balls = []
     for ball in player1_balls:
@@ -131,12 +229,27 @@ def simulate_tournament_battle(player1_balls, player2_balls, player1_name, playe
         p1_balls=p1_battle_balls,
         p2_balls=p2_battle_balls
     )
+    return run_battle(battle, with_log, seed)
+
+
+def run_battle(battle: BattleInstance, with_log=True, seed=None):
+    """Run a battle to completion and collect the result dict"""
+    # One generator per battle, so forked pool workers never share RNG state
+    rng = random.Random(seed)
     
     # Generate battle log
-    battle_log = list(gen_battle(battle))
+    if with_log:
+        battle_log_buf = io.StringIO()
+        for event in gen_battle(battle, rng=rng):
+            battle_log_buf.write(format_event(event))
+            battle_log_buf.write("\n")
+    else:
+        battle_log_buf = None
+        for _ in gen_battle(battle, emit_log=False, rng=rng):
+            pass
     
     return {
         'winner': battle.winner,
         'turns': battle.turns,
-        'battle_log': battle_log
+        'battle_log_buf': battle_log_buf
     }
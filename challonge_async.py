@@ -0,0 +1,80 @@
+from typing import List, Optional
+
+import aiohttp
+
+API_URL = "https://api.challonge.com/v1"
+
+# Calls are made while holding a tournament's lock, never wait minutes for them
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+_auth: Optional[aiohttp.BasicAuth] = None
+_session: Optional[aiohttp.ClientSession] = None
+
+
+class ChallongeError(Exception):
+    """Raised when the Challonge API answers with an error status"""
+
+    def __init__(self, status: int, errors):
+        super().__init__(f"Challonge API error {status}: {errors}")
+        self.status = status
+        self.errors = errors
+
+
+def set_credentials(username: str, api_key: str):
+    global _auth
+    _auth = aiohttp.BasicAuth(username, api_key)
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """Return the shared session, keeping connections to Challonge alive between calls"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=10), timeout=REQUEST_TIMEOUT
+        )
+    return _session
+
+
+async def close():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _read_errors(response: aiohttp.ClientResponse):
+    """Extract the errors of a failed response, which may not be JSON (e.g. a gateway page)"""
+    try:
+        payload = await response.json(content_type=None)
+    except ValueError:
+        return (await response.text())[:200]
+    return payload.get("errors") if isinstance(payload, dict) else payload
+
+
+async def _request(method: str, path: str, data=None):
+    async with _get_session().request(
+        method, f"{API_URL}/{path}.json", data=data, auth=_auth
+    ) as response:
+        if response.status >= 400:
+            raise ChallongeError(response.status, await _read_errors(response))
+        return await response.json(content_type=None)
+
+
+async def bulk_add_participants(tournament_id: int, names: List[str]) -> List[dict]:
+    """Add participants in one request, returned in the same order as ``names``"""
+    data = [("participants[][name]", name) for name in names]
+    payload = await _request("POST", f"tournaments/{tournament_id}/participants/bulk_add", data)
+    return [item["participant"] for item in payload]
+
+
+async def destroy_participant(tournament_id: int, participant_id: int):
+    await _request("DELETE", f"tournaments/{tournament_id}/participants/{participant_id}")
+
+
+async def start_tournament(tournament_id: int) -> dict:
+    payload = await _request("POST", f"tournaments/{tournament_id}/start")
+    return payload["tournament"]
+
+
+async def destroy_tournament(tournament_id: int):
+    await _request("DELETE", f"tournaments/{tournament_id}")
@@ -3,32 +3,43 @@ import random
 import re
 import asyncio
 import traceback 
-import io
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import TYPE_CHECKING, Optional
 from dataclasses import dataclass
 
 import discord
 from discord import app_commands
-from discord.ext import commands, tasks
+from discord.ext import commands
 import challonge
 
 from ballsdex.core.models import Player, BallInstance
 
-from .models import Tournament, TournamentType, TournamentState, TournamentPlayer
-from .views import TournamentRegistrationView
-from .battle_utils import BattleBall, simulate_tournament_battle
+from . import challonge_async
+from .models import Tournament, TournamentType, TournamentState, TournamentPlayer, active_tournaments
+from .views import TournamentButton, create_registration_embed, registration_view
+from .battle_utils import BattleBall, pack_team, simulate_packed_battle
 
 if TYPE_CHECKING:
     from ballsdex.core.bot import BallsDexBot
 
 log = logging.getLogger("ballsdex.packages.tournament.cog")
 
-# Global tournament storage
-active_tournaments = {}
+_SLUG_BAD = re.compile(r'[^a-z0-9_]+')
+_SLUG_MULTI = re.compile(r'_+')
 
+# How long a tournament waits for a local signal before re-checking Challonge anyway
+TOURNAMENT_POLL_INTERVAL = 60
 
-@dataclass
+# Battle workers are started from a forkserver: forking the bot directly would
+# copy the locks of its to_thread and aiohttp threads mid-use. Platforms
+# without it (Windows) spawn them instead
+_SIM_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+@dataclass(slots=True)
 class TournamentBall:
     """Tournament ball representation"""
     country: str
@@ -39,72 +50,63 @@ class TournamentBall:
     special: Optional[str] = None
 
 
-async def auto_select_balls_for_tournament(tournament: Tournament, bot):
-    """Auto-select balls for all tournament participants"""
-    failed_participants = []
-    
-    for participant in tournament.participants:
-        try:
-            player = await Player.get(pk=participant.player_id)
-            
-            # Get all ball instances for the player
-            query = BallInstance.filter(player=player).select_related('ball', 'special')
-            ball_instances = await query
-            
-            # Filter based on tournament criteria
-            eligible_instances = []
-            for instance in ball_instances:
-                ball = instance.ball
-                
-                # Check rarity constraints
-                if tournament.min_rarity is not None and ball.rarity < tournament.min_rarity:
-                    continue
-                if tournament.max_rarity is not None and ball.rarity > tournament.max_rarity:
-                    continue
-                
-                # Check special constraint
-                if not tournament.special_allowed and instance.special:
-                    continue
-                
-                # Check if ball is enabled and tradeable
-                if not ball.enabled or not ball.tradeable:
-                    continue
-                    
-                eligible_instances.append(instance)
-            
-            # Handle duplicates
-            if not tournament.duplicates_allowed:
-                # Group by ball ID and select best instance of each
-                ball_groups = {}
-                for instance in eligible_instances:
-                    ball_id = instance.ball.id
-                    if ball_id not in ball_groups:
-                        ball_groups[ball_id] = []
-                    ball_groups[ball_id].append(instance)
-                
-                # Select best instance from each group (highest combined stats)
-                selected_instances = []
-                for group in ball_groups.values():
-                    best = max(group, key=lambda x: x.health + x.attack)
-                    selected_instances.append(best)
-            else:
-                selected_instances = eligible_instances
-            
-            # Check if player has enough balls
-            if len(selected_instances) < tournament.balls_per_player:
-                failed_participants.append((participant, len(selected_instances)))
-                continue
-            
-            # Shuffle and select required number
-            random.shuffle(selected_instances)
-            selected_instances = selected_instances[:tournament.balls_per_player]
-            
-            # Convert to TournamentBall objects
-            participant.balls = []
-            for instance in selected_instances:
-                ball = instance.ball
-                
-                # Get actual emoji from bot
+SELECTION_CONCURRENCY = 8  # Max participants whose balls are fetched at once
+
+
+async def _select_for_participant(
+    participant: TournamentPlayer, tournament: Tournament, bot, emoji_cache: dict
+) -> Optional[tuple]:
+    """Auto-select balls for one participant, returns (participant, eligible_count) on failure
+
+    ``emoji_cache`` maps emoji ids to their rendered string and is shared
+    between participants of the same tournament.
+    """
+    try:
+        player = await Player.get(pk=participant.player_id)
+        
+        # Get the player's ball instances matching the tournament criteria
+        query = BallInstance.filter(player=player, ball__enabled=True, ball__tradeable=True)
+        
+        # Check rarity constraints
+        if tournament.min_rarity is not None:
+            query = query.filter(ball__rarity__gte=tournament.min_rarity)
+        if tournament.max_rarity is not None:
+            query = query.filter(ball__rarity__lte=tournament.max_rarity)
+        
+        # Check special constraint
+        if not tournament.special_allowed:
+            query = query.filter(special_id__isnull=True)
+        
+        eligible_instances = await query.select_related('ball', 'special')
+        
+        # Handle duplicates
+        if not tournament.duplicates_allowed:
+            # Keep the best instance of each ball ID (highest combined stats)
+            best_by_ball = {}
+            for instance in eligible_instances:
+                score = instance.health + instance.attack
+                best = best_by_ball.get(instance.ball.id)
+                if best is None or score > best[0]:
+                    best_by_ball[instance.ball.id] = (score, instance)
+            selected_instances = [instance for _, instance in best_by_ball.values()]
+        else:
+            selected_instances = eligible_instances
+        
+        # Check if player has enough balls
+        if len(selected_instances) < tournament.balls_per_player:
+            return (participant, len(selected_instances))
+        
+        # Randomly select required number
+        selected_instances = random.sample(selected_instances, tournament.balls_per_player)
+        
+        # Convert to TournamentBall objects
+        participant.balls = []
+        for instance in selected_instances:
+            ball = instance.ball
+            
+            # Get actual emoji from bot
+            emoji = emoji_cache.get(ball.emoji_id)
+            if emoji is None:
                 emoji = "🏀"  # Default fallback
                 try:
                     discord_emoji = bot.get_emoji(ball.emoji_id)
@@ -112,32 +114,48 @@ async def auto_select_balls_for_tournament(tournament: Tournament, bot):
                         emoji = str(discord_emoji)
                 except Exception:
                     pass
-                
-                tournament_ball = TournamentBall(
-                    country=ball.country,
-                    emoji=emoji,
-                    health=instance.health,
-                    attack=instance.attack,
-                    rarity=ball.rarity,
-                    special=instance.special.name if instance.special else None
-                )
-                participant.balls.append(tournament_ball)
-                
-        except Exception as e:
-            log.error(f"Failed to auto-select balls for {participant.user.display_name}: {e}")
-            failed_participants.append((participant, 0))
+                emoji_cache[ball.emoji_id] = emoji
+            
+            tournament_ball = TournamentBall(
+                country=ball.country,
+                emoji=emoji,
+                health=instance.health,
+                attack=instance.attack,
+                rarity=ball.rarity,
+                special=instance.special.name if instance.special else None
+            )
+            participant.balls.append(tournament_ball)
+    
+    except Exception as e:
+        log.error(f"Failed to auto-select balls for {participant.user.display_name}: {e}")
+        return (participant, 0)
+    
+    return None
+
+
+async def auto_select_balls_for_tournament(tournament: Tournament, bot):
+    """Auto-select balls for all tournament participants"""
+    semaphore = asyncio.Semaphore(SELECTION_CONCURRENCY)
+    emoji_cache = {}
+    
+    async def select(participant: TournamentPlayer):
+        async with semaphore:
+            return await _select_for_participant(participant, tournament, bot, emoji_cache)
+    
+    results = await asyncio.gather(*(select(participant) for participant in tournament.participants))
+    failed_participants = [result for result in results if result is not None]
     
     # Remove failed participants
     for participant, _ in failed_participants:
-        if participant in tournament.participants:
-            tournament.participants.remove(participant)
+        if participant.user.id in tournament.participants_by_id:
+            tournament.remove_participant(participant)
     
     return failed_participants
 
 def _slugify(text: str) -> str:
     s = (text or "").lower()
-    s = re.sub(r'[^a-z0-9_]+', '_', s)  # Replace any char NOT in a-z,0-9,_ with underscore
-    s = re.sub(r'_+', '_', s)           # Collapse repeated underscores
+    s = _SLUG_BAD.sub('_', s)           # Replace any char NOT in a-z,0-9,_ with underscore
+    s = _SLUG_MULTI.sub('_', s)         # Collapse repeated underscores
     s = s.strip('_')                    # Strip leading/trailing underscores
     return s or f"tourney_{random.randint(1000, 9999)}"
     
@@ -153,73 +171,121 @@ class TournamentCog(commands.GroupCog, name="tournament"):
         
         if challonge_username and challonge_api_key:
             challonge.set_credentials(challonge_username, challonge_api_key)
+            challonge_async.set_credentials(challonge_username, challonge_api_key)
         else:
             log.warning("Challonge credentials not configured! Set CHALLONGE_USERNAME and CHALLONGE_API_KEY environment variables.")
         
-        # Start background task
-        self.process_tournaments.start()
+        # Battles are CPU-bound, run them outside the event loop
+        self._sim_pool = self._create_sim_pool()
+        
+        # Registration buttons of every tournament are dispatched by their custom_id
+        bot.add_dynamic_items(TournamentButton)
 
-    def cog_unload(self):
-        self.process_tournaments.cancel()
+    def _create_sim_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context(_SIM_START_METHOD)
+        )
 
-    @tasks.loop(seconds=60)  # Check every minute
-    async def process_tournaments(self):
-        """Process active tournaments"""
-        for tournament in list(active_tournaments.values()):
-            if tournament.state == TournamentState.ACTIVE:
-                await self._process_tournament(tournament)
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(TournamentButton)
+        for tournament in active_tournaments.values():
+            if tournament.task:
+                tournament.task.cancel()
+        self._sim_pool.shutdown(wait=False, cancel_futures=True)
+        await challonge_async.close()
 
-    @process_tournaments.before_loop
-    async def before_process_tournaments(self):
+    async def _run_tournament_loop(self, tournament: Tournament):
+        """Process a tournament whenever it is signalled, until it ends"""
         await self.bot.wait_until_ready()
+        
+        while tournament.state in (TournamentState.REGISTRATION, TournamentState.ACTIVE):
+            try:
+                await asyncio.wait_for(tournament.advance_event.wait(), timeout=TOURNAMENT_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass  # Also covers changes made on Challonge's side
+            tournament.advance_event.clear()
+            
+            if tournament.state == TournamentState.ACTIVE:
+                await self._process_tournament(tournament)
 
     async def _process_tournament(self, tournament: Tournament):
         """Process a single tournament"""
         try:
             # Get pending matches from Challonge
-            matches = challonge.matches.index(tournament.challonge_tournament["id"])
-            
-            for match in matches:
-                if match["state"] == "open":
-                    # Find the two players
-                    player1 = None
-                    player2 = None
-                    
-                    for participant in tournament.participants:
-                        if not participant.eliminated:
-                            c_participant = tournament.challonge_participants.get(participant.user.id)
-                            if c_participant:
-                                if c_participant["id"] == match["player1_id"]:
-                                    player1 = participant
-                                elif c_participant["id"] == match["player2_id"]:
-                                    player2 = participant
-                    
-                    if player1 and player2:
-                        # Simulate battle
-                        await self._simulate_match(tournament, match, player1, player2)
-                        break  # Process one match at a time
-            
-            # Check if tournament is complete
-            tournament_info = challonge.tournaments.show(tournament.challonge_tournament["id"])
-            if tournament_info["state"] == "awaiting_review":
-                challonge.tournaments.finalize(tournament.challonge_tournament["id"])
-                tournament.state = TournamentState.FINISHED
+            matches = await asyncio.to_thread(
+                challonge.matches.index, tournament.challonge_id
+            )
+            open_matches = [match for match in matches if match["state"] == "open"]
+            
+            # Find the two players of every match that can be played
+            pairings = []
+            for match in open_matches:
+                player1 = tournament.by_challonge_id.get(match["player1_id"])
+                player2 = tournament.by_challonge_id.get(match["player2_id"])
+                
+                if player1 and player2 and not player1.eliminated and not player2.eliminated:
+                    pairings.append((match, player1, player2))
+            
+            # Simulate all battles at once so the pool runs them on separate
+            # workers, then report the results one by one
+            battle_results = await asyncio.gather(
+                *(self._simulate_battle(player1, player2) for _, player1, player2 in pairings),
+                return_exceptions=True
+            )
+            
+            played = False
+            for (match, player1, player2), battle_result in zip(pairings, battle_results):
+                if isinstance(battle_result, Exception):
+                    log.error(f"Error simulating match: {battle_result}")
+                    continue
+                # In round robin and swiss a player can be in several open matches,
+                # one reported earlier in this pass may have eliminated them
+                if player1.eliminated or player2.eliminated:
+                    continue
+                if await self._report_match(tournament, match, player1, player2, battle_result):
+                    played = True
+            
+            # Check if tournament is complete when nothing is left open or the
+            # bracket just moved, the final match may have been played this pass
+            if not open_matches or played:
+                tournament_info = await asyncio.to_thread(
+                    challonge.tournaments.show, tournament.challonge_id
+                )
+                if tournament_info["state"] == "awaiting_review":
+                    await asyncio.to_thread(
+                        challonge.tournaments.finalize, tournament.challonge_id
+                    )
+                    tournament.state = TournamentState.FINISHED
                 
         except Exception as e:
             log.error(f"Error processing tournament {tournament.name}: {e}")
 
-    async def _simulate_match(self, tournament: Tournament, challonge_match: dict, player1: TournamentPlayer, player2: TournamentPlayer):
-        """Simulate a match between two players"""
+    async def _simulate_battle(self, player1: TournamentPlayer, player2: TournamentPlayer) -> dict:
+        """Simulate a battle between two players in the process pool"""
+        log.info("starting")
+        loop = asyncio.get_running_loop()
+        args = (
+            pack_team(player1.balls),
+            pack_team(player2.balls),
+            player1.user.display_name,
+            player2.user.display_name
+        )
+        pool = self._sim_pool
+        try:
+            return await loop.run_in_executor(pool, simulate_packed_battle, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory) and the pool cannot be used
+            # again. Battles of the same pass fail together, replace it only once
+            if self._sim_pool is pool:
+                log.warning("Battle process pool broke, starting a new one")
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._sim_pool = self._create_sim_pool()
+        return await loop.run_in_executor(self._sim_pool, simulate_packed_battle, *args)
+
+    async def _report_match(self, tournament: Tournament, challonge_match: dict, player1: TournamentPlayer, player2: TournamentPlayer, battle_result: dict) -> bool:
+        """Apply a simulated match result, returns whether it was reported"""
         try:
-            # Run battle simulation
-            log.info("starting")
-            battle_result = simulate_tournament_battle(
-                player1.balls,
-                player2.balls,
-                player1.user.display_name,
-                player2.user.display_name
-            )
-            
             # Determine winner
             winner = None
             loser = None
@@ -239,20 +305,25 @@ class TournamentCog(commands.GroupCog, name="tournament"):
                 await self._handle_tournament_complete(tournament)
             
             # Update Challonge match
-            winner_participant = tournament.challonge_participants.get(winner.user.id)
-            if winner_participant:
-                challonge.matches.update(
-                    tournament.challonge_tournament["id"],
+            if winner.challonge_id is not None:
+                await asyncio.to_thread(
+                    challonge.matches.update,
+                    tournament.challonge_id,
                     challonge_match["id"],
-                    winner_id=winner_participant["id"],
+                    winner_id=winner.challonge_id,
                     scores_csv="1-0"
                 )
             
             # Send match result to channel
             await self._send_match_result(tournament, winner, loser, battle_result)
             
+            # Next matches may have opened
+            tournament.advance_event.set()
+            return True
+            
         except Exception as e:
-            log.error(f"Error simulating match: {e}")
+            log.error(f"Error reporting match: {e}")
+            return False
 
     async def _send_match_result(self, tournament: Tournament, winner: TournamentPlayer, loser: TournamentPlayer, battle_result: dict):
         """Send match result to tournament channel"""
@@ -281,10 +352,11 @@ class TournamentCog(commands.GroupCog, name="tournament"):
                 embed.add_field(name="Winner's Team", value=winner_team, inline=False)
             
             # Attach battle log
-            if battle_result['battle_log']:
-                battle_log_text = "\n".join(battle_result['battle_log'])
+            battle_log_buf = battle_result['battle_log_buf']
+            if battle_log_buf is not None and battle_log_buf.tell():
+                battle_log_buf.seek(0)
                 battle_file = discord.File(
-                    io.StringIO(battle_log_text),
+                    battle_log_buf,
                     filename=f"battle_{winner.user.display_name}_vs_{loser.user.display_name}.txt"
                 )
                 await channel.send(embed=embed, file=battle_file)
@@ -304,18 +376,16 @@ class TournamentCog(commands.GroupCog, name="tournament"):
             # Get final standings
             await asyncio.sleep(5)
             
-            participants = challonge.participants.index(tournament.challonge_tournament["id"])
+            participants = await asyncio.to_thread(
+                challonge.participants.index, tournament.challonge_id
+            )
           #participants.sort(key=lambda x: x.get('final_rank', 999))
             participants.sort(key=lambda x: x.get('final_rank') or 999)
              
             # Find champion
             champion = None
             if participants:
-                winner_data = participants[0]
-                for user_id, c_participant in tournament.challonge_participants.items():
-                    if c_participant["id"] == winner_data["id"]:
-                        champion = next((p for p in tournament.participants if p.user.id == user_id), None)
-                        break
+                champion = tournament.by_challonge_id.get(participants[0]["id"])
             
             embed = discord.Embed(
                 title=f"Tournament Complete: {tournament.name}",
@@ -341,10 +411,10 @@ class TournamentCog(commands.GroupCog, name="tournament"):
                 inline=False
             )
             
-            if tournament.challonge_tournament:
+            if tournament.challonge_url:
                 embed.add_field(
                     name="🔗 Full Results",
-                    value=f"[View on Challonge]({tournament.challonge_tournament['full_challonge_url']})",
+                    value=f"[View on Challonge]({tournament.challonge_url})",
                     inline=False
                 )
             
@@ -421,7 +491,8 @@ class TournamentCog(commands.GroupCog, name="tournament"):
         
         # Create Challonge tournament
         try:
-            challonge_tournament = challonge.tournaments.create(
+            challonge_tournament = await asyncio.to_thread(
+                challonge.tournaments.create,
                 tournament_id,
                 slug,
                 tournament_type=t_type.value,
@@ -447,19 +518,21 @@ class TournamentCog(commands.GroupCog, name="tournament"):
             special_allowed=special_allowed,
             duplicates_allowed=duplicates_allowed,
             balls_per_player=balls_per_player,
-            challonge_tournament=challonge_tournament
+            challonge_tournament=challonge_tournament,
+            challonge_id=challonge_tournament["id"],
+            challonge_url=challonge_tournament["full_challonge_url"]
         )
         
         active_tournaments[interaction.guild_id] = tournament
+        tournament.task = asyncio.create_task(self._run_tournament_loop(tournament))
         
-        # Create registration view and embed
-        view = TournamentRegistrationView(tournament)
-        embed = view._create_registration_embed()
+        # Create registration embed
+        embed = create_registration_embed(tournament)
         
         await interaction.followup.send(
             f"Tournament **{name}** created!.",
             embed=embed,
-            view=view
+            view=registration_view(tournament)
         )
 
     @app_commands.command()
@@ -474,9 +547,8 @@ class TournamentCog(commands.GroupCog, name="tournament"):
             return
         
         if tournament.state == TournamentState.REGISTRATION:
-            view = TournamentRegistrationView(tournament)
-            embed = view._create_registration_embed()
-            await interaction.response.send_message(embed=embed, view=view)
+            embed = create_registration_embed(tournament)
+            await interaction.response.send_message(embed=embed, view=registration_view(tournament))
         elif tournament.state == TournamentState.ACTIVE:
             embed = discord.Embed(
                 title=f"{tournament.name}",
@@ -498,10 +570,10 @@ class TournamentCog(commands.GroupCog, name="tournament"):
                 eliminated_list = "\n".join([f"• {p.user.display_name}" for p in eliminated_participants[-5:]])
                 embed.add_field(name="Recently Eliminated", value=eliminated_list, inline=False)
             
-            if tournament.challonge_tournament:
+            if tournament.challonge_url:
                 embed.add_field(
                     name="📊 Tournament Bracket",
-                    value=f"[View on Challonge]({tournament.challonge_tournament['full_challonge_url']})",
+                    value=f"[View on Challonge]({tournament.challonge_url})",
                     inline=False
                 )
             
@@ -513,10 +585,10 @@ class TournamentCog(commands.GroupCog, name="tournament"):
                 color=discord.Color.gold()
             )
             
-            if tournament.challonge_tournament:
+            if tournament.challonge_url:
                 embed.add_field(
                     name="Final Results",
-                    value=f"[View on Challonge]({tournament.challonge_tournament['full_challonge_url']})",
+                    value=f"[View on Challonge]({tournament.challonge_url})",
                     inline=False
                 )
             
@@ -534,7 +606,7 @@ class TournamentCog(commands.GroupCog, name="tournament"):
             return
         
         # Find participant
-        participant = next((p for p in tournament.participants if p.user.id == interaction.user.id), None)
+        participant = tournament.participants_by_id.get(interaction.user.id)
         
         if not participant:
             await interaction.response.send_message(
@@ -586,13 +658,24 @@ class TournamentCog(commands.GroupCog, name="tournament"):
             )
             return
         
-        # Cancel Challonge tournament
-        try:
-            challonge.tournaments.destroy(tournament.challonge_tournament["id"])
-        except Exception as e:
-            log.error(f"Failed to cancel Challonge tournament: {e}")
+        await interaction.response.defer()
         
-        tournament.state = TournamentState.CANCELLED
+        # Taken like the cancel button, so a start in progress cannot turn the
+        # tournament back to active after it was cancelled
+        async with tournament.lock:
+            # Cancel Challonge tournament
+            if tournament.challonge_id is not None:
+                try:
+                    await challonge_async.destroy_tournament(tournament.challonge_id)
+                except Exception as e:
+                    log.error(f"Failed to cancel Challonge tournament: {e}")
+            
+            tournament.state = TournamentState.CANCELLED
+            tournament.advance_event.set()
+            
+            # Remove from active tournaments
+            if active_tournaments.get(tournament.guild_id) is tournament:
+                del active_tournaments[tournament.guild_id]
         
         embed = discord.Embed(
             title=f"❌ Tournament Cancelled",
@@ -600,10 +683,4 @@ class TournamentCog(commands.GroupCog, name="tournament"):
             color=discord.Color.red()
         )
         
-        await interaction.response.send_message(embed=embed)
-        
-        # Remove from active tournaments
-        if tournament.guild_id in active_tournaments:
-            del active_tournaments[tournament.guild_id]
-
-
+        await interaction.followup.send(embed=embed)
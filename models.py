@@ -1,11 +1,16 @@
 from __future__ import annotations
 
-from typing import Optional, List
+import asyncio
+from typing import Optional, List, Dict
 from dataclasses import dataclass, field
 from enum import Enum
 
 import discord
 
+# Tournaments in progress, keyed by guild id
+active_tournaments = {}
+
+
 class TournamentType(Enum):
     SINGLE_ELIMINATION = "single elimination"
     DOUBLE_ELIMINATION = "double elimination"
@@ -20,16 +25,20 @@ class TournamentState(Enum):
     CANCELLED = "cancelled"
 
 
-@dataclass
+@dataclass(slots=True)
 class TournamentPlayer:
     """Represents a player in the tournament"""
     user: discord.Member
     player_id: int
+    display_name: str = ""  # Captured on join, used for embed rendering
     balls: List = field(default_factory=list)  # Will hold BattleBall objects
     eliminated: bool = False
+    index: int = -1  # Position in Tournament.participants
+    challonge_id: Optional[int] = None  # Challonge participant id, set when the tournament starts
+    challonge_name: Optional[str] = None  # Name on the bracket, display_name unless it collided
 
 
-@dataclass
+@dataclass(slots=True)
 class Tournament:
     """Simplified tournament object"""
     name: str
@@ -45,11 +54,52 @@ class Tournament:
     special_allowed: bool = True
     duplicates_allowed: bool = False
     balls_per_player: int = 5
+    config_text: str = field(init=False, default="")  # Rendered from the criteria above
+    registration_embed: Optional[discord.Embed] = None  # Cached until participants change
     
     # Tournament state
     state: TournamentState = TournamentState.REGISTRATION
+    # A list rather than a deque: remove_participant assigns into arbitrary slots
     participants: List[TournamentPlayer] = field(default_factory=list)
+    participants_by_id: Dict[int, TournamentPlayer] = field(default_factory=dict)  # Discord user id -> participant
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # Guards registration checks and updates
     
     # Challonge integration
     challonge_tournament: Optional[dict] = None
-    challonge_participants: dict = field(default_factory=dict) 
+    challonge_id: Optional[int] = None
+    challonge_url: Optional[str] = None
+    by_challonge_id: Dict[int, TournamentPlayer] = field(default_factory=dict)  # Challonge participant id -> TournamentPlayer
+    
+    # Background processing
+    advance_event: asyncio.Event = field(default_factory=asyncio.Event)  # Set when the bracket may have moved
+    task: Optional[asyncio.Task] = None
+    
+    def __post_init__(self):
+        # The configuration never changes after creation, render it once
+        config_text = f"**Max Participants:** {self.max_participants}\n"
+        config_text += f"**Balls per Player:** {self.balls_per_player}\n"
+        
+        if self.min_rarity is not None:
+            config_text += f"**Min Rarity:** {self.min_rarity}\n"
+        if self.max_rarity is not None:
+            config_text += f"**Max Rarity:** {self.max_rarity}\n"
+        
+        config_text += f"**Special Balls:** {'Allowed' if self.special_allowed else 'Not Allowed'}\n"
+        config_text += f"**Duplicates:** {'Allowed' if self.duplicates_allowed else 'Not Allowed'}"
+        self.config_text = config_text
+    
+    def add_participant(self, participant: TournamentPlayer):
+        participant.index = len(self.participants)
+        self.participants.append(participant)
+        self.participants_by_id[participant.user.id] = participant
+        self.registration_embed = None
+    
+    def remove_participant(self, participant: TournamentPlayer):
+        """Remove a participant in O(1) by moving the last participant into its slot"""
+        del self.participants_by_id[participant.user.id]
+        last = self.participants.pop()
+        if last is not participant:
+            self.participants[participant.index] = last
+            last.index = participant.index
+        participant.index = -1
+        self.registration_embed = None
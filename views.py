@@ -1,254 +1,359 @@
 import logging
-from typing import TYPE_CHECKING
+import re
+from typing import TYPE_CHECKING, List, Set
 
 import discord
-import challonge 
 
 from ballsdex.core.models import Player
-from .models import Tournament, TournamentPlayer, TournamentState
+from . import challonge_async
+from .models import Tournament, TournamentPlayer, TournamentState, active_tournaments
 
 if TYPE_CHECKING:
     from ballsdex.core.bot import BallsDexBot
 
 log = logging.getLogger("ballsdex.packages.tournament.views")
 
+# Enum members are singletons, compare them by identity
+_REGISTRATION = TournamentState.REGISTRATION
+_ACTIVE = TournamentState.ACTIVE
+_CANCELLED = TournamentState.CANCELLED
 
-class TournamentRegistrationView(discord.ui.View):
-    """Simple view for tournament registration only"""
-    
-    def __init__(self, tournament: Tournament):
-        super().__init__(timeout=None)
-        self.tournament = tournament
-        
-    @discord.ui.button(label="Join Tournament", style=discord.ButtonStyle.primary)
-    async def join_tournament(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_join(interaction)
-        
-    @discord.ui.button(label="Leave Tournament", style=discord.ButtonStyle.secondary)
-    async def leave_tournament(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_leave(interaction)
-        
-    @discord.ui.button(label="Start Tournament", style=discord.ButtonStyle.success)
-    async def start_tournament(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_start(interaction)
-        
-    @discord.ui.button(label="Cancel Tournament", style=discord.ButtonStyle.danger)
-    async def cancel_tournament(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_cancel(interaction)
+# Built once at import instead of on every embed or reply
+_COLOR_GOLD = discord.Color.gold()
+_COLOR_RED = discord.Color.red()
+_COLOR_GREEN = discord.Color.green()
+_JOINED_FMT = "✅ You have joined the tournament! ({}/{})".format
+
+# Label and style of each registration button, keyed by action
+_BUTTONS = {
+    "join": ("Join Tournament", discord.ButtonStyle.primary),
+    "leave": ("Leave Tournament", discord.ButtonStyle.secondary),
+    "start": ("Start Tournament", discord.ButtonStyle.success),
+    "cancel": ("Cancel Tournament", discord.ButtonStyle.danger),
+}
+
+
+class TournamentButton(
+    discord.ui.DynamicItem[discord.ui.Button],
+    template=r"tourney:(?P<action>join|leave|start|cancel):(?P<tournament_id>[0-9]+)"
+):
+    """Registration button of one tournament
+
+    The custom_id carries the action and the Challonge id of the tournament it
+    was created for. The class is registered once with ``bot.add_dynamic_items``,
+    so no view is kept per tournament, and clicks on a message left over from an
+    earlier tournament in the guild are rejected.
+    """
     
-    async def _handle_join(self, interaction: discord.Interaction):
-        """Handle join tournament button"""
-        # Check if user is already in tournament
-        for participant in self.tournament.participants:
-            if participant.user.id == interaction.user.id:
-                await interaction.response.send_message(
-                    "You are already registered for this tournament!", ephemeral=True
-                )
-                return
-        
-        # Check if tournament is full
-        if len(self.tournament.participants) >= self.tournament.max_participants:
-            await interaction.response.send_message(
-                "Tournament is full!", ephemeral=True
+    def __init__(self, action: str, tournament_id: int):
+        label, style = _BUTTONS[action]
+        super().__init__(
+            discord.ui.Button(
+                label=label, style=style, custom_id=f"tourney:{action}:{tournament_id}"
             )
-            return
-            
-        # Check if registration is still open
-        if self.tournament.state != TournamentState.REGISTRATION:
+        )
+        self.action = action
+        self.tournament_id = tournament_id
+    
+    @classmethod
+    async def from_custom_id(
+        cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str]
+    ):
+        return cls(match["action"], int(match["tournament_id"]))
+    
+    async def callback(self, interaction: discord.Interaction):
+        tournament = active_tournaments.get(interaction.guild_id)
+        if tournament is None or tournament.challonge_id != self.tournament_id:
             await interaction.response.send_message(
-                "Registration is closed for this tournament!", ephemeral=True
+                "This tournament is no longer active!", ephemeral=True
             )
             return
+        await getattr(self, f"{self.action}_tournament")(interaction, tournament)
         
-        # Create player
-        player, _ = await Player.get_or_create(discord_id=interaction.user.id)
-        participant = TournamentPlayer(
-            user=interaction.user,
-            player_id=player.pk
-        )
-        
-        self.tournament.participants.append(participant)
+    async def join_tournament(self, interaction: discord.Interaction, tournament: Tournament):
+        """Handle join tournament button"""
+        # A start holds the lock for a while, never make Discord wait on it
+        await interaction.response.defer()
         
-        # Add to Challonge
-        try:
-            challonge_participant = challonge.participants.create(
-                self.tournament.challonge_tournament["id"],
-                interaction.user.display_name
+        async with tournament.lock:
+            # Check if user is already in tournament
+            if interaction.user.id in tournament.participants_by_id:
+                await interaction.followup.send(
+                    "You are already registered for this tournament!", ephemeral=True
+                )
+                return
+            
+            # Check if tournament is full
+            if len(tournament.participants) >= tournament.max_participants:
+                await interaction.followup.send(
+                    "Tournament is full!", ephemeral=True
+                )
+                return
+                
+            # Check if registration is still open
+            if tournament.state is not _REGISTRATION:
+                await interaction.followup.send(
+                    "Registration is closed for this tournament!", ephemeral=True
+                )
+                return
+            
+            # Create player
+            player, _ = await Player.get_or_create(discord_id=interaction.user.id)
+            participant = TournamentPlayer(
+                user=interaction.user,
+                player_id=player.pk,
+                display_name=interaction.user.display_name
             )
-            self.tournament.challonge_participants[participant.user.id] = challonge_participant
-        except Exception as e:
-            log.error(f"Failed to add participant to Challonge: {e}")
+            
+            tournament.add_participant(participant)
+            participant_count = len(tournament.participants)
         
-        await interaction.response.send_message(
-            f"✅ You have joined the tournament! ({len(self.tournament.participants)}/{self.tournament.max_participants})",
+        await interaction.followup.send(
+            _JOINED_FMT(participant_count, tournament.max_participants),
             ephemeral=True
         )
         
-    async def _handle_leave(self, interaction: discord.Interaction):
+    async def leave_tournament(self, interaction: discord.Interaction, tournament: Tournament):
         """Handle leave tournament button"""
-        participant_to_remove = None
-        for participant in self.tournament.participants:
-            if participant.user.id == interaction.user.id:
-                participant_to_remove = participant
-                break
+        # Removing a player from Challonge can take longer than Discord waits
+        # for an answer, acknowledge the click first
+        await interaction.response.defer()
         
-        if not participant_to_remove:
-            await interaction.response.send_message(
-                "You are not registered for this tournament!", ephemeral=True
-            )
-            return
+        async with tournament.lock:
+            participant_to_remove = tournament.participants_by_id.get(interaction.user.id)
             
-        if self.tournament.state != TournamentState.REGISTRATION:
-            await interaction.response.send_message(
-                "You cannot leave once the tournament has started!", ephemeral=True
-            )
-            return
-        
-        self.tournament.participants.remove(participant_to_remove)
-        
-        # Remove from Challonge
-        try:
-            challonge_participant = self.tournament.challonge_participants.get(interaction.user.id)
-            if challonge_participant:
-                challonge.participants.destroy(
-                    self.tournament.challonge_tournament["id"],
-                    challonge_participant["id"]
+            if not participant_to_remove:
+                await interaction.followup.send(
+                    "You are not registered for this tournament!", ephemeral=True
                 )
-                del self.tournament.challonge_participants[interaction.user.id]
-        except Exception as e:
-            log.error(f"Failed to remove participant from Challonge: {e}")
+                return
+                
+            if tournament.state is not _REGISTRATION:
+                await interaction.followup.send(
+                    "You cannot leave once the tournament has started!", ephemeral=True
+                )
+                return
+            
+            # Registered by a failed start, take them out of the bracket too.
+            # If this fails, the next start removes them instead
+            if participant_to_remove.challonge_id is not None:
+                try:
+                    await _unregister_participant(tournament, participant_to_remove)
+                except Exception as e:
+                    log.error("Failed to remove Challonge participant: %s", e)
+            
+            tournament.remove_participant(participant_to_remove)
+            
+            embed = create_registration_embed(tournament)
         
-        await interaction.response.send_message(
+        await interaction.followup.send(
             "❌ You have left the tournament!", ephemeral=True
         )
         
-        embed = self._create_registration_embed()
         await interaction.edit_original_response(embed=embed)
     
-    async def _handle_start(self, interaction: discord.Interaction):
+    async def start_tournament(self, interaction: discord.Interaction, tournament: Tournament):
         """Handle start tournament button - starts the tournament and removes view"""
-        if interaction.user.id != self.tournament.organizer.id:
+        if interaction.user.id != tournament.organizer.id:
             await interaction.response.send_message(
                 "You Dond have permmision to start this tournament!", ephemeral=True
             )
             return
-            
-        if len(self.tournament.participants) < 2:
-            await interaction.response.send_message(
-                "Need at least 2 participants to start the tournament!", ephemeral=True
-            )
-            return
-            
-        if self.tournament.state != TournamentState.REGISTRATION:
-            await interaction.response.send_message(
-                "Tournament has already been started!", ephemeral=True
-            )
-            return
         
         await interaction.response.defer()
         
-        # Import here to avoid circular imports
-        from .cog import auto_select_balls_for_tournament
-        
-        try:
-            # Auto-select balls for all participants
-            await auto_select_balls_for_tournament(self.tournament, interaction.client)
-            
-            # Start Challonge tournament
-            challonge.tournaments.start(self.tournament.challonge_tournament["id"])
-            self.tournament.state = TournamentState.ACTIVE
+        # Held until the tournament is started, so nobody joins or leaves mid-selection
+        async with tournament.lock:
+            if len(tournament.participants) < 2:
+                await interaction.followup.send(
+                    "Need at least 2 participants to start the tournament!", ephemeral=True
+                )
+                return
+                
+            if tournament.state is not _REGISTRATION:
+                await interaction.followup.send(
+                    "Tournament has already been started!", ephemeral=True
+                )
+                return
             
-            # Create final embed with no buttons
-            embed = discord.Embed(
-                title=f"{self.tournament.name}",
-                description="Tournament has started! Battles will be processed automatically.",
-                color=discord.Color.green()
-            )
+            # Import here to avoid circular imports
+            from .cog import auto_select_balls_for_tournament
             
+            try:
+                # Auto-select balls for all participants
+                await auto_select_balls_for_tournament(tournament, interaction.client)
+                
+                # Register the remaining participants and start the Challonge tournament
+                await _register_participants(tournament)
+                await challonge_async.start_tournament(tournament.challonge_id)
+                
+                # Never revive a tournament cancelled while it was starting
+                if tournament.state is not _REGISTRATION:
+                    return
+                tournament.state = _ACTIVE
+                tournament.advance_event.set()
+            except Exception as e:
+                log.error("Failed to start tournament: %s", e)
+                embed = discord.Embed(
+                    title=f"❌ {tournament.name}",
+                    description=f"Failed to start tournament: {str(e)[:200]}",
+                    color=_COLOR_RED
+                )
+                await interaction.edit_original_response(embed=embed)
+                return
+        
+        # Create final embed with no buttons
+        embed = discord.Embed(
+            title=f"{tournament.name}",
+            description="Tournament has started! Battles will be processed automatically.",
+            color=_COLOR_GREEN
+        )
+        
+        embed.add_field(
+            name="📊 Tournament Info",
+            value=f"**Participants:** {len(tournament.participants)}\n**Type:** {tournament.tournament_type.value.title()}",
+            inline=False
+        )
+        
+        if tournament.challonge_url:
             embed.add_field(
-                name="📊 Tournament Info",
-                value=f"**Participants:** {len(self.tournament.participants)}\n**Type:** {self.tournament.tournament_type.value.title()}",
+                name="📈 Tournament Bracket",
+                value=f"[View on Challonge]({tournament.challonge_url})",
                 inline=False
             )
-            
-            if self.tournament.challonge_tournament:
-                embed.add_field(
-                    name="📈 Tournament Bracket",
-                    value=f"[View on Challonge]({self.tournament.challonge_tournament['full_challonge_url']})",
-                    inline=False
-                )
-            
-            # Remove view - tournament is now active
-            await interaction.edit_original_response(embed=embed, view=None)
-            
-        except Exception as e:
-            log.error(f"Failed to start tournament: {e}")
-            embed = discord.Embed(
-                title=f"❌ {self.tournament.name}",
-                description=f"Failed to start tournament: {str(e)[:200]}",
-                color=discord.Color.red()
-            )
-            await interaction.edit_original_response(embed=embed)
+        
+        # Remove view - tournament is now active
+        await interaction.edit_original_response(embed=embed, view=None)
     
-    async def _handle_cancel(self, interaction: discord.Interaction):
+    async def cancel_tournament(self, interaction: discord.Interaction, tournament: Tournament):
         """Handle cancel tournament button"""
-        if interaction.user.id != self.tournament.organizer.id:
+        if interaction.user.id != tournament.organizer.id:
             await interaction.response.send_message(
                 "You Dond have permission to cancel this tournament!", ephemeral=True
             )
             return
         
-        self.tournament.state = TournamentState.CANCELLED
+        await interaction.response.defer()
         
-        # Cancel Challonge tournament
-        try:
-            challonge.tournaments.destroy(self.tournament.challonge_tournament["id"])
-        except Exception as e:
-            log.error(f"Failed to cancel Challonge tournament: {e}")
+        async with tournament.lock:
+            tournament.state = _CANCELLED
+            tournament.advance_event.set()
+            
+            # Cancel Challonge tournament, unless it was never registered there
+            if tournament.challonge_id is not None:
+                try:
+                    await challonge_async.destroy_tournament(tournament.challonge_id)
+                except Exception as e:
+                    log.error("Failed to cancel Challonge tournament: %s", e)
         
         embed = discord.Embed(
             title=f"❌ Tournament Cancelled",
-            description=f"**{self.tournament.name}** has been cancelled.",
-            color=discord.Color.red()
+            description=f"**{tournament.name}** has been cancelled.",
+            color=_COLOR_RED
         )
         
-        await interaction.response.edit_message(embed=embed, view=None)
+        await interaction.edit_original_response(embed=embed, view=None)
+
+
+def registration_view(tournament: Tournament) -> discord.ui.View:
+    """Build the registration buttons of a tournament, to attach to a message"""
+    view = discord.ui.View(timeout=None)
+    for action in _BUTTONS:
+        view.add_item(TournamentButton(action, tournament.challonge_id))
+    return view
+
+
+async def _register_participants(tournament: Tournament):
+    """Add every participant not yet on Challonge in a single request
     
-    def _create_registration_embed(self) -> discord.Embed:
-        """Create embed for registration phase"""
-        embed = discord.Embed(
-            title=f"🏆 {self.tournament.name}",
-            description=f"**Type:** {self.tournament.tournament_type.value.title()}\n**State:** Registration Open",
-            color=discord.Color.gold()
-        )
-        
-        # Configuration
-        config_text = f"**Max Participants:** {self.tournament.max_participants}\n"
-        config_text += f"**Balls per Player:** {self.tournament.balls_per_player}\n"
-        
-        if self.tournament.min_rarity is not None:
-            config_text += f"**Min Rarity:** {self.tournament.min_rarity}\n"
-        if self.tournament.max_rarity is not None:
-            config_text += f"**Max Rarity:** {self.tournament.max_rarity}\n"
-        
-        config_text += f"**Special Balls:** {'Allowed' if self.tournament.special_allowed else 'Not Allowed'}\n"
-        config_text += f"**Duplicates:** {'Allowed' if self.tournament.duplicates_allowed else 'Not Allowed'}"
-        
-        embed.add_field(name="⚙️ Configuration", value=config_text, inline=False)
-        
-        # Participants
-        if self.tournament.participants:
-            participant_list = "\n".join([f"• {p.user.display_name}" for p in self.tournament.participants])
-            if len(participant_list) > 1024:
-                participant_list = participant_list[:1021] + "..."
-        else:
-            participant_list = "No participants yet"
-        
-        embed.add_field(
-            name=f"👥 Participants ({len(self.tournament.participants)}/{self.tournament.max_participants})",
-            value=participant_list,
-            inline=False
-        )
-        
-        embed.set_footer(text=f"Organized by {self.tournament.organizer.display_name}")
-        return embed
+    Players registered by an earlier, failed start who have since left or
+    were dropped by ball selection are removed from Challonge first.
+    """
+    for participant in list(tournament.by_challonge_id.values()):
+        if tournament.participants_by_id.get(participant.user.id) is not participant:
+            await _unregister_participant(tournament, participant)
+    
+    participants = [
+        p for p in tournament.participants
+        if p.challonge_id is None
+    ]
+    if not participants:
+        return
+    
+    # Challonge rejects the whole request on a duplicate name
+    taken = {p.challonge_name.lower() for p in tournament.by_challonge_id.values()}
+    names = _bracket_names(participants, taken)
+    created = await challonge_async.bulk_add_participants(tournament.challonge_id, names)
+    
+    for participant, name, challonge_participant in zip(participants, names, created):
+        participant.challonge_id = challonge_participant["id"]
+        participant.challonge_name = name
+        tournament.by_challonge_id[participant.challonge_id] = participant
+
+
+def _bracket_names(participants: List[TournamentPlayer], taken: Set[str]) -> List[str]:
+    """Bracket names for ``participants``, a name already in ``taken`` gets " #2", " #3"...
+    
+    ``taken`` holds lowercased names and is updated with the returned ones.
+    """
+    names = []
+    for participant in participants:
+        name = participant.display_name
+        suffix = 1
+        while name.lower() in taken:
+            suffix += 1
+            name = f"{participant.display_name} #{suffix}"
+        taken.add(name.lower())
+        names.append(name)
+    return names
+
+
+async def _unregister_participant(tournament: Tournament, participant: TournamentPlayer):
+    """Remove a participant from Challonge and forget its Challonge id"""
+    await challonge_async.destroy_participant(tournament.challonge_id, participant.challonge_id)
+    tournament.by_challonge_id.pop(participant.challonge_id, None)
+    participant.challonge_id = None
+    participant.challonge_name = None
+
+
+def create_registration_embed(tournament: Tournament) -> discord.Embed:
+    """Create embed for registration phase, reused until participants change"""
+    if tournament.registration_embed is not None:
+        return tournament.registration_embed
+    
+    embed = discord.Embed(
+        title=f"🏆 {tournament.name}",
+        description=f"**Type:** {tournament.tournament_type.value.title()}\n**State:** Registration Open",
+        color=_COLOR_GOLD
+    )
+    
+    # Configuration
+    embed.add_field(name="⚙️ Configuration", value=tournament.config_text, inline=False)
+    
+    # Participants
+    participants = tournament.participants
+    if not participants:
+        participant_list = "No participants yet"
+    else:
+        # Stop building once the 1024 character field limit is reached
+        parts = []
+        total = 0
+        for p in participants:
+            line = f"• {p.display_name}\n"
+            if total + len(line) > 1021:
+                parts.append("...")
+                break
+            parts.append(line)
+            total += len(line)
+        participant_list = "".join(parts).rstrip("\n")
+    
+    embed.add_field(
+        name=f"👥 Participants ({len(participants)}/{tournament.max_participants})",
+        value=participant_list,
+        inline=False
+    )
+    
+    embed.set_footer(text=f"Organized by {tournament.organizer.display_name}")
+    
+    tournament.registration_embed = embed
+    return embed